@@ -5,34 +5,124 @@ Supports two encoding modes:
 - 2-Pass: Target size-based compression with precise bitrate control
 """
 
+import json
+import math
 import os
+import re
 import shutil
 import subprocess
-from typing import Optional, Tuple
+import tempfile
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
 import ffmpeg
 
 from app.presets import get_preset, PresetConfig
-from app.utils import get_file_size_mb
+from app.utils import (
+    MB_PER_BYTE,
+    NO_WINDOW_FLAGS,
+    fast_copy,
+    get_cached_caps,
+    get_file_size_mb,
+)
 
 
-def get_video_info(path: str) -> Tuple[int, int, float, int, float]:
-    """Extract video metadata from file.
+# Hardware H.264 encoders in order of preference; libx264 is the fallback
+_HW_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf")
+
+# Detected video encoder, resolved once per process by _detect_encoder()
+_ENCODER: Optional[str] = None
+
+# Run encodes at reduced priority so background jobs don't starve the UI;
+# set FFMPEG_LOW_PRIORITY=0 to run them at normal priority
+_LOW_PRIORITY = os.environ.get("FFMPEG_LOW_PRIORITY", "1") != "0"
+
+# Header-only probe limits: enough to read dimensions and duration without
+# letting ffprobe decode frames to refine stream info.
+_PROBE_LIMITS = ["-analyzeduration", "1000000", "-probesize", "1000000"]
+
+# AAC re-encode bitrate, and the highest source AAC bitrate that is
+# stream-copied instead of re-encoded
+_AUDIO_KBPS = 96
+_AUDIO_COPY_MAX_KBPS = 128
+
+# A CRF pass 2 is kept only if it fills at least this share of target_mb;
+# smaller outputs waste budget and are redone as ABR pass 2
+_TARGET_MIN_FILL = 0.9
+
+# Seconds of video_kbps in the VBV buffer of a CRF pass 2; the long-run
+# rate stays capped while complex scenes can still borrow bits
+_VBV_SECONDS = 8
+
+# R-QP correction constants for picking the pass-2 CRF from pass-1 stats:
+# how strongly QP follows the bit budget ratio, and how strongly low QPs are
+# pulled back towards 24 (weaker for SD outputs)
+_RQ_C_LOW = 0.5
+_RQ_C_HIGH_SD = 0.25
+_RQ_C_HIGH_HD = 0.5
+
+# Per-frame bit counts in an x264 pass-1 stats file
+_X264_STATS_FRAME = re.compile(r"tex:(\d+) mv:(\d+) misc:(\d+)")
+
+# CRF-mode sources at or below this bitrate are copied instead of re-encoded
+_COPY_MAX_KBPS = 350
+
+# Sources up to this factor over the target size first try a lossless remux
+_REMUX_MAX_OVERSHOOT = 1.10
+
+def _probe_header(path: str) -> dict:
+    """Run a lightweight ffprobe that only reads container/stream headers.
     
     Args:
         path: Path to video file
         
     Returns:
-        Tuple of (width, height, duration_seconds, bitrate_kbps)
+        Parsed ffprobe JSON output with all streams and format
         
     Raises:
-        ffmpeg.Error: If probe fails or stream not found
+        subprocess.CalledProcessError: If ffprobe fails
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        *_PROBE_LIMITS,
+        "-show_entries", "stream=codec_type,codec_name,width,height,bit_rate:format=duration,bit_rate",
+        "-of", "json",
+        path
+    ]
+    result = subprocess.run(cmd, capture_output=True, creationflags=NO_WINDOW_FLAGS, check=True)
+    return json.loads(result.stdout)
+
+
+@lru_cache(maxsize=64)
+def _cached_video_info(
+    path: str,
+    mtime_ns: int,
+    size: int
+) -> Tuple[int, int, float, int, float, Optional[str], int]:
+    """Probe video metadata, memoized by path, modification time and size.
+    
+    Args:
+        path: Absolute path to video file
+        mtime_ns: File modification time in nanoseconds (cache key)
+        size: File size in bytes (cache key)
+        
+    Returns:
+        Tuple of (width, height, duration_seconds, bitrate_kbps, size_mb,
+        audio_codec, audio_kbps); audio_codec is None without an audio stream
     """
-    probe = ffmpeg.probe(path)
+    probe = _probe_header(path)
     video_stream = next(
-        (s for s in probe["streams"] if s["codec_type"] == "video"),
+        (s for s in probe.get("streams", []) if s.get("codec_type") == "video"),
         None
     )
     
+    # Fall back to a full probe if the header did not carry what we need
+    if not video_stream or "width" not in video_stream or "height" not in video_stream:
+        probe = ffmpeg.probe(path)
+        video_stream = next(
+            (s for s in probe["streams"] if s["codec_type"] == "video"),
+            None
+        )
+    
     if not video_stream:
         raise ValueError(f"No video stream found in {path}")
     
@@ -41,15 +131,127 @@ def get_video_info(path: str) -> Tuple[int, int, float, int, float]:
     duration = float(probe["format"]["duration"])
     bitrate = int(probe["format"].get("bit_rate", 0)) // 1000  # kbps
     
-    size_mb = get_file_size_mb(path)
-    return width, height, duration, bitrate, size_mb
+    audio_stream = next(
+        (s for s in probe["streams"] if s.get("codec_type") == "audio"),
+        {}
+    )
+    audio_codec = audio_stream.get("codec_name")
+    audio_kbps = int(audio_stream.get("bit_rate", 0)) // 1000
+    
+    size_mb = size * MB_PER_BYTE
+    return width, height, duration, bitrate, size_mb, audio_codec, audio_kbps
+
+
+def get_full_info(path: str) -> Tuple[int, int, float, int, float, Optional[str], int]:
+    """Extract video metadata from file.
+    
+    Results are cached per (path, mtime, size), so re-queueing the same
+    file does not probe it again. The cache is per process: under the GUI's
+    worker pool a re-queued file only hits it when it lands on the same
+    worker.
+    
+    Args:
+        path: Path to video file
+        
+    Returns:
+        Tuple of (width, height, duration_seconds, bitrate_kbps, size_mb,
+        audio_codec, audio_kbps); audio_codec is None without an audio stream
+        
+    Raises:
+        subprocess.CalledProcessError: If ffprobe fails
+        ffmpeg.Error: If the fallback full probe fails
+        ValueError: If no video stream is found
+    """
+    stat = os.stat(path)
+    return _cached_video_info(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=64)
+def _cached_target_info(
+    path: str,
+    mtime_ns: int,
+    size: int
+) -> Tuple[float, Optional[str], int]:
+    """Probe duration and first audio stream, memoized like _cached_video_info.
+    
+    Args:
+        path: Absolute path to video file
+        mtime_ns: File modification time in nanoseconds (cache key)
+        size: File size in bytes (cache key)
+        
+    Returns:
+        Tuple of (duration_seconds, audio_codec, audio_kbps); audio_codec
+        is None without an audio stream
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        *_PROBE_LIMITS,
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name,bit_rate:format=duration",
+        "-of", "json",
+        path
+    ]
+    result = subprocess.run(cmd, capture_output=True, creationflags=NO_WINDOW_FLAGS, check=True)
+    probe = json.loads(result.stdout)
+    try:
+        duration = float(probe["format"]["duration"])
+    except (KeyError, ValueError):
+        raise ValueError(f"No duration found in {path}")
+    
+    audio_stream = (probe.get("streams") or [{}])[0]
+    audio_codec = audio_stream.get("codec_name")
+    audio_kbps = int(audio_stream.get("bit_rate", 0)) // 1000
+    return duration, audio_codec, audio_kbps
+
+
+def get_target_info(path: str) -> Tuple[float, Optional[str], int]:
+    """Get what target-size mode needs to budget the bitrate.
+    
+    A single header-sized ffprobe returns the duration and the first audio
+    stream; results are cached per (path, mtime, size) like get_full_info.
+    
+    Args:
+        path: Path to video file
+        
+    Returns:
+        Tuple of (duration_seconds, audio_codec, audio_kbps); audio_codec
+        is None without an audio stream
+        
+    Raises:
+        subprocess.CalledProcessError: If ffprobe fails
+        ValueError: If ffprobe reports no duration
+    """
+    stat = os.stat(path)
+    return _cached_target_info(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def is_complete_output(path: str) -> bool:
+    """Check whether an encoded output file was fully written.
+    
+    MP4 outputs only get their moov box when ffmpeg finishes the file, so
+    one left behind by a failed encode has no duration to probe.
+    
+    Args:
+        path: Path to output file
+        
+    Returns:
+        True if the file exists and ffprobe reads a duration from it
+    """
+    if not os.path.exists(path):
+        return False
+    try:
+        probe = _probe_header(path)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return False
+    return "duration" in probe.get("format", {})
 
 
 def compress_video(
     input_file: str,
     output_file: str,
     preset: str = "medium",
-    target_mb: Optional[int] = None
+    target_mb: Optional[int] = None,
+    threads: Optional[int] = None
 ) -> float:
     """Compress video with specified preset and optional target size.
     
@@ -62,6 +264,7 @@ def compress_video(
         output_file: Path for output compressed video
         preset: Compression preset ('light', 'medium', or 'strong')
         target_mb: Optional target file size in MB; if provided uses 2-pass encoding
+        threads: Optional ffmpeg thread count; defaults to FFMPEG_THREADS or ffmpeg's own choice
         
     Returns:
         Compressed file size in MB
@@ -73,166 +276,756 @@ def compress_video(
     # Get preset configuration
     preset_config = get_preset(preset)
     
-    # Extract video info
-    width, height, duration, src_kbps, src_size_mb = get_video_info(input_file)
-    
     # Calculate scaling filter
-    max_height = preset_config["max_height"]
-    scale_filter = f"scale=-2:{max_height}"
-    
-    audio_kbps = 96
+    scale_filter = _scale_filter(preset_config)
     
     if target_mb is not None:
+        src_size_mb = get_file_size_mb(input_file)
         if src_size_mb <= (target_mb - 0.2):
-            shutil.copy(input_file, output_file)
+            fast_copy(input_file, output_file)
             return get_file_size_mb(output_file)
 
     # ========= TARGET MB MODE (2-PASS ENCODING) =========
     if target_mb:
+        # Slightly oversized sources often fit once extra tracks, chapters
+        # and metadata are dropped, which costs no encoding at all
+        if src_size_mb <= target_mb * _REMUX_MAX_OVERSHOOT:
+            if _try_remux(input_file, output_file, target_mb - 0.2):
+                return get_file_size_mb(output_file)
+        
+        # Only the duration and audio stream are needed to budget the bitrate
+        duration, audio_codec, src_audio_kbps = get_target_info(input_file)
+        audio_kbps = _audio_kbps(audio_codec, src_audio_kbps)
+        
         # Calculate video bitrate to meet target size
         total_kbps = int(target_mb * 8192 / duration)
-        video_kbps = max(total_kbps - audio_kbps, 300)
+        audio_budget = src_audio_kbps if audio_kbps is None else audio_kbps
+        video_kbps = max(total_kbps - audio_budget, 300)
         
-        _two_pass_encode(
+        _encode_with_fallback(
+            _two_pass_encode,
             input_file,
             output_file,
             scale_filter,
             video_kbps,
+            duration,
+            preset_config.max_height,
             audio_kbps,
-            preset_config["preset"]
+            preset_config.crf,
+            preset_config.preset,
+            preset_config.tune,
+            threads,
+            target_mb=target_mb
         )
         
-        # Clean up ffmpeg log files
-        for logfile in ("ffmpeg2pass-0.log", "ffmpeg2pass-0.log.mbtree"):
-            if os.path.exists(logfile):
-                os.remove(logfile)
-        
         return get_file_size_mb(output_file)
     
     # ========= NORMAL MODE (CRF - CONSTANT RATE FACTOR) =========
-    # Calculate video bitrate based on preset
-    video_kbps = max(
-        int(src_kbps * preset_config["video_kbps_mult"]), 
-        350
-    ) if src_kbps else 1200
-    
-    # Skip encoding if source is already smaller than target
-    if src_kbps and src_kbps <= video_kbps:
-        shutil.copy(input_file, output_file)
+    _, _, _, src_kbps, _, audio_codec, src_audio_kbps = get_full_info(input_file)
+    
+    # Skip encoding if the source bitrate is already too low to gain anything
+    if _already_small(src_kbps):
+        fast_copy(input_file, output_file)
         return get_file_size_mb(output_file)
     
-    # Single-pass encoding
-    _one_pass_encode(
+    audio_kbps = _audio_kbps(audio_codec, src_audio_kbps)
+    
+    # Single-pass constant quality encoding
+    _encode_with_fallback(
+        _crf_encode,
         input_file,
         output_file,
         scale_filter,
-        video_kbps,
-        audio_kbps,
-        preset_config["preset"]
+        crf=preset_config.crf,
+        preset=preset_config.preset,
+        audio_kbps=audio_kbps,
+        tune=preset_config.tune,
+        threads=threads
     )
     
     return get_file_size_mb(output_file)
 
 
+def compress_many(
+    jobs: List[Tuple[str, str]],
+    preset: str = "medium",
+    threads: Optional[int] = None
+) -> List[float]:
+    """Compress several videos in CRF mode with a single FFmpeg invocation.
+    
+    All inputs are opened by one ffmpeg process and each is mapped to its
+    own output, so process startup and demuxer init are paid once per batch
+    instead of once per file.
+    
+    Args:
+        jobs: List of (input_file, output_file) pairs
+        preset: Compression preset shared by all jobs ('light', 'medium', or 'strong')
+        threads: Optional ffmpeg thread count per output
+        
+    Returns:
+        Compressed file sizes in MB, in the same order as jobs
+        
+    Raises:
+        KeyError: If preset is invalid
+        ValueError: If video probe fails
+        subprocess.CalledProcessError: If ffmpeg fails
+    """
+    preset_config = get_preset(preset)
+    scale_filter = _scale_filter(preset_config)
+    
+    to_encode: List[Tuple[str, str, Optional[int]]] = []
+    for input_file, output_file in jobs:
+        _, _, _, src_kbps, _, audio_codec, src_audio_kbps = get_full_info(input_file)
+        
+        # Skip encoding if the source bitrate is already too low to gain anything
+        if _already_small(src_kbps):
+            fast_copy(input_file, output_file)
+        else:
+            to_encode.append((input_file, output_file, _audio_kbps(audio_codec, src_audio_kbps)))
+    
+    if to_encode:
+        _encode_with_fallback(
+            _multi_encode,
+            to_encode,
+            scale_filter,
+            crf=preset_config.crf,
+            preset=preset_config.preset,
+            tune=preset_config.tune,
+            threads=threads
+        )
+    
+    return [get_file_size_mb(output_file) for _, output_file in jobs]
+
+
+def _audio_kbps(audio_codec: Optional[str], src_audio_kbps: int) -> Optional[int]:
+    """Decide how to handle the audio track.
+    
+    AAC sources at a known bitrate up to _AUDIO_COPY_MAX_KBPS are copied;
+    re-encoding them would only cost CPU and quality.
+    
+    Args:
+        audio_codec: Source audio codec name (None if no audio stream)
+        src_audio_kbps: Source audio bitrate in kbps (0 if unknown)
+        
+    Returns:
+        AAC bitrate to encode at, or None to stream-copy the source audio
+    """
+    if audio_codec == "aac" and 0 < src_audio_kbps <= _AUDIO_COPY_MAX_KBPS:
+        return None
+    return _AUDIO_KBPS
+
+
+def _audio_args(audio_kbps: Optional[int]) -> List[str]:
+    """Build audio codec options.
+    
+    Args:
+        audio_kbps: AAC bitrate in kbps, or None to stream-copy
+        
+    Returns:
+        List of ffmpeg audio options
+    """
+    if audio_kbps is None:
+        return ["-c:a", "copy"]
+    return ["-c:a", "aac", "-b:a", f"{audio_kbps}k"]
+
+
+def _scale_filter(preset_config: PresetConfig) -> str:
+    """Build the FFmpeg scale filter for a preset.
+    
+    Downscales to the preset's max height with its scaler algorithm (cheaper
+    taps for stronger presets) and converts to limited range. The colour
+    matrix is left alone, so the source's colour tags still describe the
+    output and untagged sources pass through unconverted.
+    
+    Args:
+        preset_config: Preset configuration
+        
+    Returns:
+        FFmpeg scale filter string
+    """
+    return (
+        f"scale=-2:{preset_config.max_height}"
+        f":flags={preset_config.scale_flags}"
+        ":in_range=auto:out_range=tv"
+    )
+
+
+def _already_small(src_kbps: int) -> bool:
+    """Check whether the source bitrate is too low to be worth re-encoding.
+    
+    The bitrate is only used to decide whether re-encoding is worth it; the
+    encode itself runs in constant quality mode. The threshold is a fixed
+    floor rather than a multiple of the source bitrate, which would treat
+    every source as small for presets with video_kbps_mult >= 1.0 (light).
+    
+    Args:
+        src_kbps: Source bitrate in kbps (0 if unknown)
+        
+    Returns:
+        True if the source can be copied as-is
+    """
+    return 0 < src_kbps <= _COPY_MAX_KBPS
+
+
+def _try_remux(input_file: str, output_file: str, max_mb: float) -> bool:
+    """Stream-copy the first video and audio tracks into a fresh MP4.
+    
+    The remux goes to a temporary file next to the output and only
+    replaces it if the result fits within max_mb.
+    
+    Args:
+        input_file: Path to input video
+        output_file: Path for output video
+        max_mb: Largest acceptable output size in MB
+        
+    Returns:
+        True if output_file now holds a remux within max_mb
+    """
+    fd, tmp_file = tempfile.mkstemp(
+        suffix=".mp4",
+        dir=os.path.dirname(os.path.abspath(output_file))
+    )
+    os.close(fd)
+    
+    cmd = [
+        "ffmpeg", "-y",
+        "-i", input_file,
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        "-map_metadata", "-1",
+        "-map_chapters", "-1",
+        "-c", "copy",
+        "-movflags", "+faststart",
+        tmp_file
+    ]
+    
+    try:
+        _run_ffmpeg(cmd)
+        if get_file_size_mb(tmp_file) <= max_mb:
+            os.replace(tmp_file, output_file)
+            return True
+    except subprocess.CalledProcessError:
+        # Codecs that MP4 can't carry; fall through to a real encode
+        pass
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return False
+
+
+def _encode_with_fallback(encode: Callable[..., None], *args, **kwargs) -> None:
+    """Run an encode, retrying once with libx264 if a hardware encoder fails.
+    
+    Hardware encoders can fail at encode time even after passing detection,
+    e.g. when concurrent jobs exceed the GPU's encode session limit.
+    
+    Args:
+        encode: Encode function accepting an `encoder` keyword argument
+        *args: Positional arguments for encode
+        **kwargs: Keyword arguments for encode
+        
+    Raises:
+        subprocess.CalledProcessError: If the libx264 encode fails too
+    """
+    encoder = _detect_encoder()
+    try:
+        encode(*args, encoder=encoder, **kwargs)
+    except subprocess.CalledProcessError:
+        if encoder == "libx264":
+            raise
+        encode(*args, encoder="libx264", **kwargs)
+
+
 def _two_pass_encode(
     input_file: str,
     output_file: str,
     scale_filter: str,
     video_kbps: int,
-    audio_kbps: int,
-    preset: str
+    duration: float,
+    output_height: int,
+    audio_kbps: Optional[int],
+    crf: int,
+    preset: str,
+    tune: Optional[str] = None,
+    threads: Optional[int] = None,
+    target_mb: Optional[float] = None,
+    encoder: Optional[str] = None
 ) -> None:
     """Encode video using 2-pass encoding for precise bitrate control.
     
-    First pass analyzes content, second pass encodes with calculated bitrate.
+    Hardware encoders run a single bitrate-targeted pass instead; if that
+    output exceeds target_mb, the job is redone with libx264 2-pass.
+    
+    First pass analyzes content at the preset's CRF, so the bits it spends
+    show what that quality costs for this source. An R-QP correction turns
+    the ratio of the budget to those bits into the pass-2 CRF, encoded
+    under a VBV cap at the target bitrate. If that output is over
+    target_mb or fills less than _TARGET_MIN_FILL of it, or the pass-1
+    stats can't be read, pass 2 is run as a classic ABR second pass from
+    the same stats.
     
     Args:
         input_file: Path to input video
         output_file: Path for output video
         scale_filter: FFmpeg scale filter string
         video_kbps: Target video bitrate in kbps
-        audio_kbps: Audio bitrate in kbps
+        duration: Input duration in seconds
+        output_height: Output height in pixels after scaling
+        audio_kbps: Audio bitrate in kbps, or None to stream-copy audio
+        crf: Constant rate factor for pass 1 (the preset's CRF)
         preset: FFmpeg preset (ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
+        tune: Optional x264 tune (e.g. 'film', 'fastdecode')
+        threads: Optional ffmpeg thread count
+        target_mb: Optional output size limit in MB
+        encoder: Video encoder to use; defaults to _detect_encoder()
     """
-    null_device = "NUL" if os.name == "nt" else "/dev/null"
+    encoder = encoder or _detect_encoder()
+    if encoder != "libx264":
+        # Hardware encoders don't support ffmpeg's -pass; NVENC does its
+        # own multipass analysis inside a single run.
+        cmd = [
+            "ffmpeg", "-y",
+            "-i", input_file,
+            "-map", "0:v:0",
+            "-map", "0:a:0?",
+            "-vf", scale_filter,
+            *_video_codec_args(encoder, video_kbps, preset),
+            *(["-multipass", "fullres"] if encoder == "h264_nvenc" else []),
+            *_thread_args(encoder, threads),
+            *_audio_args(audio_kbps),
+            "-movflags", "+faststart",
+            output_file
+        ]
+        _run_ffmpeg(cmd)
+        if not target_mb or get_file_size_mb(output_file) <= target_mb:
+            return
+        # Single-pass VBR overshot the limit; only x264 2-pass can enforce it
+        encoder = "libx264"
+    
+    # Per-job stats file so concurrent 2-pass jobs don't clobber ffmpeg2pass-0.log
+    passlog_dir = tempfile.mkdtemp(prefix="ffmpeg2pass-")
+    passlogfile = os.path.join(passlog_dir, "ffmpeg2pass")
     
-    # PASS 1: Analysis pass
+    # PASS 1: Analysis pass at a fixed quality. Only the video stream is
+    # demuxed, x264 runs its fast first-pass analysis (-fastfirstpass,
+    # ffmpeg's default, made explicit), and output goes to the null muxer.
     cmd_pass1 = [
         "ffmpeg", "-y",
         "-i", input_file,
+        "-map", "0:v:0",
         "-vf", scale_filter,
         "-c:v", "libx264",
-        "-b:v", f"{video_kbps}k",
+        "-crf", str(crf),
         "-pass", "1",
+        "-passlogfile", passlogfile,
         "-preset", preset,
-        "-an",
-        "-f", "mp4",
-        null_device
+        *_x264_tune_args(tune),
+        "-fastfirstpass", "1",
+        *_thread_args(encoder, threads),
+        "-f", "null",
+        "-"
     ]
     
-    # PASS 2: Encoding pass
-    cmd_pass2 = [
-        "ffmpeg", "-y",
-        "-i", input_file,
-        "-vf", scale_filter,
-        "-c:v", "libx264",
-        "-b:v", f"{video_kbps}k",
-        "-pass", "2",
-        "-preset", preset,
-        "-c:a", "aac",
-        "-b:a", f"{audio_kbps}k",
-        "-movflags", "+faststart",
-        output_file
-    ]
+    try:
+        _run_ffmpeg(cmd_pass1)
+        
+        attempts = [[
+            "-b:v", f"{video_kbps}k",
+            "-pass", "2",
+            "-passlogfile", passlogfile,
+        ]]
+        pass1_bits = _read_pass1_stats(f"{passlogfile}-0.log")
+        if pass1_bits:
+            pass2_crf = _corrected_crf(crf, pass1_bits, video_kbps * 1000 * duration, output_height)
+            attempts.insert(0, [
+                "-crf", str(pass2_crf),
+                "-maxrate", f"{video_kbps}k",
+                "-bufsize", f"{video_kbps * _VBV_SECONDS}k",
+            ])
+        
+        # PASS 2: Encoding pass. A CRF encode that misses the size window
+        # either way is redone as ABR pass 2, which is kept as is.
+        for rate_args in attempts:
+            # Same video stream as pass 1, so ABR pass 2 reads matching stats
+            cmd_pass2 = [
+                "ffmpeg", "-y",
+                "-i", input_file,
+                "-map", "0:v:0",
+                "-map", "0:a:0?",
+                "-vf", scale_filter,
+                "-c:v", "libx264",
+                *rate_args,
+                "-preset", preset,
+                *_x264_tune_args(tune),
+                *_thread_args(encoder, threads),
+                *_audio_args(audio_kbps),
+                "-movflags", "+faststart",
+                output_file
+            ]
+            _run_ffmpeg(cmd_pass2)
+            if not target_mb:
+                break
+            size_mb = get_file_size_mb(output_file)
+            if target_mb * _TARGET_MIN_FILL <= size_mb <= target_mb:
+                break
+    finally:
+        shutil.rmtree(passlog_dir, ignore_errors=True)
+
+
+def _read_pass1_stats(stats_file: str) -> Optional[int]:
+    """Read the total bits spent from an x264 pass-1 stats file.
     
-    subprocess.run(
-        cmd_pass1,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        check=True
-    )
-    subprocess.run(
-        cmd_pass2,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        check=True
-    )
+    Args:
+        stats_file: Path to the x264 stats log
+        
+    Returns:
+        Total video bits, or None if no frames could be read
+    """
+    total_bits = 0
+    try:
+        with open(stats_file, "r", encoding="ascii", errors="ignore") as f:
+            for line in f:
+                match = _X264_STATS_FRAME.search(line)
+                if match:
+                    total_bits += sum(int(group) for group in match.groups())
+    except OSError:
+        return None
+    
+    return total_bits or None
+
+
+def _corrected_crf(
+    qp: float,
+    pass1_bits: int,
+    target_bits: float,
+    output_height: int
+) -> int:
+    """Pick the pass-2 CRF from pass-1 results with an R-QP correction.
+    
+    The pass-1 CRF is shifted by the log ratio of the target budget to the
+    bits pass 1 actually spent at it, then low values are pulled back
+    towards 24, more strongly for HD outputs where they waste the most bits.
+    
+    Args:
+        qp: CRF pass 1 was encoded at
+        pass1_bits: Total video bits spent by pass 1
+        target_bits: Video bit budget for the output
+        output_height: Output height in pixels
+        
+    Returns:
+        CRF for the second pass, clamped to x264's 0-51 range
+    """
+    q_bar = qp - _RQ_C_LOW * math.sqrt(max(1.0, qp)) * math.log2(target_bits / pass1_bits)
+    c_high = _RQ_C_HIGH_SD if output_height <= 480 else _RQ_C_HIGH_HD
+    q_new = round(q_bar + c_high * max(0.0, 24 - q_bar))
+    return min(max(q_new, 0), 51)
 
 
-def _one_pass_encode(
+def _crf_encode(
     input_file: str,
     output_file: str,
     scale_filter: str,
-    video_kbps: int,
-    audio_kbps: int,
-    preset: str
+    crf: int,
+    preset: str,
+    audio_kbps: Optional[int],
+    tune: Optional[str] = None,
+    threads: Optional[int] = None,
+    encoder: Optional[str] = None
 ) -> None:
-    """Encode video using single-pass encoding.
+    """Encode video using single-pass constant quality (CRF) encoding.
     
     Args:
         input_file: Path to input video
         output_file: Path for output video
         scale_filter: FFmpeg scale filter string
-        video_kbps: Target video bitrate in kbps
-        audio_kbps: Audio bitrate in kbps
+        crf: Constant rate factor (lower is better quality)
         preset: FFmpeg preset (ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
+        audio_kbps: Audio bitrate in kbps, or None to stream-copy audio
+        tune: Optional x264 tune (e.g. 'film', 'fastdecode')
+        threads: Optional ffmpeg thread count
+        encoder: Video encoder to use; defaults to _detect_encoder()
     """
+    # Same stream selection as _multi_encode, so batching doesn't change the output
     cmd = [
         "ffmpeg", "-y",
         "-i", input_file,
-        "-vf", scale_filter,
-        "-c:v", "libx264",
-        "-b:v", f"{video_kbps}k",
-        "-preset", preset,
-        "-c:a", "aac",
-        "-b:a", f"{audio_kbps}k",
-        "-movflags", "+faststart",
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        *_crf_output_args(scale_filter, crf, preset, audio_kbps, tune, threads, encoder),
         output_file
     ]
     
+    _run_ffmpeg(cmd)
+
+
+def init_worker() -> None:
+    """Prepare a worker process for running encodes.
+    
+    Used as the process pool initializer. On POSIX the worker becomes a
+    process group leader, so it and its ffmpeg children can be killed
+    together when the app closes, and lowers its own priority once; the
+    ffmpeg processes it starts inherit it.
+    """
+    if os.name != "nt":
+        os.setpgrp()
+        if _LOW_PRIORITY:
+            os.nice(10)
+
+
+def _run_ffmpeg(cmd: List[str]) -> None:
+    """Run an ffmpeg encode with its output discarded.
+    
+    No preexec_fn is used, so CPython keeps its fast vfork/posix_spawn
+    process creation. Lower priority comes from BELOW_NORMAL_PRIORITY_CLASS
+    on Windows; on POSIX it is inherited from the worker (see init_worker).
+    
+    Args:
+        cmd: ffmpeg command line
+        
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg fails
+    """
+    creationflags = NO_WINDOW_FLAGS
+    if _LOW_PRIORITY and os.name == "nt":
+        creationflags |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    
     subprocess.run(
         cmd,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
+        close_fds=True,
+        creationflags=creationflags,
         check=True
     )
+
+
+def _multi_encode(
+    jobs: List[Tuple[str, str, Optional[int]]],
+    scale_filter: str,
+    crf: int,
+    preset: str,
+    tune: Optional[str] = None,
+    threads: Optional[int] = None,
+    encoder: Optional[str] = None
+) -> None:
+    """Encode several inputs to separate outputs in one ffmpeg process.
+    
+    Args:
+        jobs: List of (input_file, output_file, audio_kbps) triples; audio_kbps
+            is None to stream-copy that input's audio
+        scale_filter: FFmpeg scale filter string
+        crf: Constant rate factor (lower is better quality)
+        preset: FFmpeg preset (ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
+        tune: Optional x264 tune (e.g. 'film', 'fastdecode')
+        threads: Optional ffmpeg thread count
+        encoder: Video encoder to use; defaults to _detect_encoder()
+    """
+    cmd = ["ffmpeg", "-y"]
+    for input_file, _, _ in jobs:
+        cmd += ["-i", input_file]
+    
+    for index, (_, output_file, audio_kbps) in enumerate(jobs):
+        cmd += [
+            "-map", f"{index}:v:0",
+            "-map", f"{index}:a:0?",
+            *_crf_output_args(scale_filter, crf, preset, audio_kbps, tune, threads, encoder),
+            output_file
+        ]
+    
+    _run_ffmpeg(cmd)
+
+
+def _crf_output_args(
+    scale_filter: str,
+    crf: int,
+    preset: str,
+    audio_kbps: Optional[int],
+    tune: Optional[str] = None,
+    threads: Optional[int] = None,
+    encoder: Optional[str] = None
+) -> List[str]:
+    """Build per-output FFmpeg options for constant quality encoding.
+    
+    Args:
+        scale_filter: FFmpeg scale filter string
+        crf: Constant rate factor (lower is better quality)
+        preset: FFmpeg preset (ultrafast, superfast, veryfast, faster, fast, medium, slow, slower, veryslow)
+        audio_kbps: Audio bitrate in kbps, or None to stream-copy audio
+        tune: Optional x264 tune (e.g. 'film', 'fastdecode')
+        threads: Optional ffmpeg thread count
+        encoder: Video encoder to use; defaults to _detect_encoder()
+        
+    Returns:
+        List of ffmpeg output options
+    """
+    encoder = encoder or _detect_encoder()
+    return [
+        "-vf", scale_filter,
+        *_quality_codec_args(encoder, crf, preset, tune),
+        *_thread_args(encoder, threads),
+        *_audio_args(audio_kbps),
+        "-movflags", "+faststart",
+    ]
+
+
+def _quality_codec_args(
+    encoder: str,
+    crf: int,
+    preset: str,
+    tune: Optional[str] = None
+) -> List[str]:
+    """Build encoder-specific video codec options for constant quality.
+    
+    Hardware encoders expose their own constant quality knobs, which are
+    fed the CRF value directly. VideoToolbox has no comparable mode, so
+    CRF encodes fall back to libx264 there.
+    
+    Args:
+        encoder: FFmpeg video encoder name (see _detect_encoder)
+        crf: Constant rate factor (lower is better quality)
+        preset: x264 preset name; only used by encoders that understand it
+        tune: Optional x264 tune; ignored by hardware encoders
+        
+    Returns:
+        List of ffmpeg video codec options
+    """
+    if encoder == "h264_nvenc":
+        return [
+            "-c:v", encoder,
+            "-preset", "p4",
+            "-tune", "hq",
+            "-rc", "vbr",
+            "-cq", str(crf),
+            "-b:v", "0",
+        ]
+    if encoder == "h264_qsv":
+        return ["-c:v", encoder, "-preset", preset, "-global_quality", str(crf)]
+    if encoder == "h264_amf":
+        return ["-c:v", encoder, "-rc", "cqp", "-qp_i", str(crf), "-qp_p", str(crf)]
+    return [
+        "-c:v", "libx264",
+        "-crf", str(crf),
+        "-preset", preset,
+        *_x264_tune_args(tune),
+    ]
+
+
+def _x264_tune_args(tune: Optional[str]) -> List[str]:
+    """Build libx264 tune options.
+    
+    Args:
+        tune: Optional x264 tune (e.g. 'film', 'fastdecode')
+        
+    Returns:
+        List of ffmpeg options (empty if no tune)
+    """
+    return ["-tune", tune] if tune else []
+
+
+def _thread_args(encoder: str, threads: Optional[int] = None) -> List[str]:
+    """Build encoder threading options.
+    
+    FFmpeg's default thread count is already tuned per encoder, so
+    `-threads` is only passed when a count is given by the caller or
+    FFMPEG_THREADS is set explicitly. libx264 additionally gets frame
+    threading for better throughput.
+    
+    Args:
+        encoder: FFmpeg video encoder name
+        threads: Optional thread count; takes precedence over FFMPEG_THREADS
+        
+    Returns:
+        List of ffmpeg options
+    """
+    args = []
+    count = str(threads) if threads else os.environ.get("FFMPEG_THREADS", "").strip()
+    if count:
+        args += ["-threads", count]
+    if encoder == "libx264":
+        args += ["-thread_type", "frame"]
+    return args
+
+
+def _video_codec_args(encoder: str, video_kbps: int, preset: str) -> List[str]:
+    """Build encoder-specific video codec options for a target bitrate.
+    
+    Args:
+        encoder: FFmpeg video encoder name (see _detect_encoder)
+        video_kbps: Target video bitrate in kbps
+        preset: x264 preset name; only used by encoders that understand it
+        
+    Returns:
+        List of ffmpeg video codec options
+    """
+    if encoder == "h264_nvenc":
+        return [
+            "-c:v", encoder,
+            "-preset", "p4",
+            "-tune", "hq",
+            "-rc", "vbr",
+            "-b:v", f"{video_kbps}k",
+            "-maxrate", f"{video_kbps * 2}k",
+        ]
+    if encoder == "h264_qsv":
+        return ["-c:v", encoder, "-preset", preset, "-b:v", f"{video_kbps}k"]
+    if encoder == "h264_videotoolbox":
+        return ["-c:v", encoder, "-b:v", f"{video_kbps}k", "-allow_sw", "1"]
+    if encoder == "h264_amf":
+        return ["-c:v", encoder, "-b:v", f"{video_kbps}k"]
+    return ["-c:v", "libx264", "-b:v", f"{video_kbps}k", "-preset", preset]
+
+
+def _detect_encoder() -> str:
+    """Pick the fastest usable H.264 encoder.
+    
+    Returns the first hardware encoder that is both compiled in and able to
+    open a device (verified with a tiny test encode), otherwise libx264.
+    Only the encoder listing is cached on disk; the test encode runs once
+    per process, so a GPU or driver that goes away between runs is noticed.
+    
+    Returns:
+        FFmpeg video encoder name
+    """
+    global _ENCODER
+    if _ENCODER is not None:
+        return _ENCODER
+    
+    caps = get_cached_caps()
+    _ENCODER = "libx264"
+    for encoder in _HW_ENCODERS:
+        if encoder in caps["encoders"] and _encoder_works(encoder):
+            _ENCODER = encoder
+            break
+    return _ENCODER
+
+
+def _encoder_works(encoder: str) -> bool:
+    """Check that an encoder can actually open its device.
+    
+    Builds often list hardware encoders even when no matching GPU or
+    driver is present, so a short synthetic encode is the only reliable test.
+    
+    Args:
+        encoder: FFmpeg video encoder name
+        
+    Returns:
+        True if the test encode succeeded
+    """
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "error",
+        "-f", "lavfi", "-i", "color=black:s=256x256:d=0.1",
+        "-c:v", encoder,
+        "-f", "null", "-"
+    ]
+    try:
+        subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=NO_WINDOW_FLAGS,
+            check=True,
+            timeout=15
+        )
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return True
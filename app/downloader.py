@@ -1,15 +1,67 @@
 """Video downloader module using yt-dlp."""
 
 import os
-from typing import Optional
+import shutil
+import threading
+from typing import Any, Dict
 import yt_dlp
 
 
+# One YoutubeDL per output directory, reused across downloads so extractors
+# and HTTP sessions are set up once. YoutubeDL is not thread-safe, so all
+# access goes through _YDL_LOCK.
+_YDL_INSTANCES: Dict[str, yt_dlp.YoutubeDL] = {}
+_YDL_LOCK = threading.Lock()
+
+
+def _ydl_options(out_dir: str) -> Dict[str, Any]:
+    """Build yt-dlp options for downloading into a directory.
+    
+    Args:
+        out_dir: Output directory for downloaded videos
+        
+    Returns:
+        yt-dlp options dict
+    """
+    ydl_opts = {
+        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
+        "format": "bv*[vcodec^=avc1][ext=mp4]+ba[ext=m4a]/b[ext=mp4]",
+        "merge_output_format": "mp4",
+        "quiet": True,
+        # Fetch DASH/HLS fragments in parallel and in large HTTP chunks
+        "concurrent_fragment_downloads": 8,
+        "http_chunk_size": 10 << 20,
+    }
+
+    if shutil.which("aria2c"):
+        ydl_opts["external_downloader"] = {"default": "aria2c"}
+        ydl_opts["external_downloader_args"] = {"aria2c": ["-x16", "-s16"]}
+
+    return ydl_opts
+
+
+def _get_ydl(out_dir: str) -> yt_dlp.YoutubeDL:
+    """Get the shared YoutubeDL instance for a directory (caller holds _YDL_LOCK).
+    
+    Args:
+        out_dir: Output directory for downloaded videos
+        
+    Returns:
+        Cached YoutubeDL instance
+    """
+    key = os.path.abspath(out_dir)
+    if key not in _YDL_INSTANCES:
+        _YDL_INSTANCES[key] = yt_dlp.YoutubeDL(_ydl_options(out_dir))
+    return _YDL_INSTANCES[key]
+
+
 def download_video(url: str, out_dir: str = ".") -> str:
     """Download video from URL using yt-dlp.
     
     Supports YouTube, TikTok, and many other video hosting platforms.
     Downloads best quality video+audio and merges into MP4 format.
+    Reuses a persistent YoutubeDL session, and hands fragmented downloads
+    to aria2c when it is installed.
     
     Args:
         url: URL to the video
@@ -21,13 +73,7 @@ def download_video(url: str, out_dir: str = ".") -> str:
     Raises:
         yt_dlp.utils.DownloadError: If download fails
     """
-    ydl_opts = {
-        "outtmpl": os.path.join(out_dir, "%(title)s.%(ext)s"),
-        "format": "bv*[vcodec^=avc1][ext=mp4]+ba[ext=m4a]/b[ext=mp4]",
-        "merge_output_format": "mp4",
-        "quiet": True,
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+    with _YDL_LOCK:
+        ydl = _get_ydl(out_dir)
         info = ydl.extract_info(url, download=True)
         return ydl.prepare_filename(info)
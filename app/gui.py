@@ -4,71 +4,253 @@ Provides a Tkinter interface for:
 - Compressing videos with multiple presets (light, medium, strong)
 - Supporting local files and video URLs (via download)
 - Real-time compression progress logging
-- Multi-threaded background processing
+- Parallel background processing in a worker process pool
 """
 
+import multiprocessing
 import os
 import threading
-from queue import Queue
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Empty, Queue
 from tkinter import Tk, Entry, Button, Text, Scrollbar, StringVar, Label
 from tkinter.filedialog import askopenfilename
-from typing import Optional
+from typing import List, Optional, Tuple
 
-from app.compressor import compress_video
-from app.utils import output_filename
+from app.compressor import compress_many, compress_video, init_worker, is_complete_output
+from app.utils import get_file_size_mb, kill_process_tree, output_filename
 from app.downloader import download_video
 
 
+Job = Tuple[str, str, str, Optional[int]]
+
+# Log line prefixes: plain ASCII by default since emoji force font fallback
+# lookups on every Text insert; set VERBOSE_UI=1 to get the emoji back
+if os.environ.get("VERBOSE_UI"):
+    LOG_RUN, LOG_OK, LOG_ERR, LOG_TGT = "🔧", "✔", "❌", "🎯"
+else:
+    LOG_RUN, LOG_OK, LOG_ERR, LOG_TGT = "[RUN]", "[OK]", "[ERR]", "[TGT]"
+
+
+def _ffmpeg_threads(default: int = 4) -> int:
+    """Get the per-job ffmpeg thread budget.
+    
+    Args:
+        default: Thread count used when FFMPEG_THREADS is unset or invalid
+        
+    Returns:
+        FFMPEG_THREADS if it is a positive integer, otherwise default
+    """
+    try:
+        threads = int(os.environ.get("FFMPEG_THREADS", ""))
+    except ValueError:
+        return default
+    return threads if threads > 0 else default
+
+
 class CompressorApp:
     """GUI application for video compression with threaded background processing."""
     
+    # Maximum number of queued jobs the dispatcher drains into one batch
+    BATCH_SIZE = 4
+    
+    # Delay (ms) over which log messages are coalesced into one widget update
+    LOG_FLUSH_MS = 50
+    
+    # Threads given to each ffmpeg process (FFMPEG_THREADS, default 4);
+    # parallel jobs = cores // this, keeping the total encoder thread budget
+    # close to the core count
+    FFMPEG_THREADS = _ffmpeg_threads()
+    
     def __init__(self) -> None:
         """Initialize the compression app."""
         self.task_queue: Queue = Queue()
         self.current_preset: str = "medium"
         
+        # Process pool sized so concurrent jobs don't oversubscribe the CPU
+        self.n_jobs: int = max(1, (os.cpu_count() or 1) // self.FFMPEG_THREADS)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.slots = threading.Semaphore(self.n_jobs)
+        self.unbatchable: set[str] = set()
+        
         # UI components
         self.root: Optional[Tk] = None
         self.status_var: Optional[StringVar] = None
         self.linkInput: Optional[Entry] = None
         self.targetEntry: Optional[Entry] = None
         self.log: Optional[Text] = None
+        
+        # Pending log lines, flushed to the widget in batches
+        self.log_buffer: deque = deque()
+        self.log_lock = threading.Lock()
+        self.log_flush_scheduled: bool = False
 
-    def worker(self) -> None:
-        """Process video compression tasks from queue.
+    def dispatcher(self) -> None:
+        """Hand queued compression tasks to the process pool.
         
-        Runs in background thread(s), continuously polling the task queue
-        and executing compression jobs with logging and error handling.
+        Runs in a single background thread. It waits for a free pool slot
+        before taking work, so jobs queued while all slots are busy pile up.
+        Only when no other slot is free are they drained (up to BATCH_SIZE)
+        into one batch that shares a single ffmpeg invocation; otherwise
+        the next free slot would find the queue already emptied.
         """
         while True:
-            input_file, output_file, preset, target_mb = self.task_queue.get()
+            self.slots.acquire()
+            jobs: List[Job] = [self.task_queue.get()]
+            if self.slots.acquire(blocking=False):
+                self.slots.release()
+            else:
+                while len(jobs) < self.BATCH_SIZE:
+                    try:
+                        jobs.append(self.task_queue.get_nowait())
+                    except Empty:
+                        break
+
+            for index, unit in enumerate(self.group_jobs(jobs)):
+                if index:
+                    self.slots.acquire()
+                self.submit(unit)
+
+    def group_jobs(self, jobs: List[Job]) -> List[List[Job]]:
+        """Split drained jobs into units of work for the pool.
+        
+        CRF-mode jobs sharing a preset are grouped into one batch; target-size
+        jobs, singletons and jobs from a previously failed batch run alone.
+        
+        Args:
+            jobs: List of (input_file, output_file, preset, target_mb) tuples
+            
+        Returns:
+            List of job groups, each submitted as one pool task
+        """
+        batches: dict[str, List[Job]] = {}
+        units: List[List[Job]] = []
+        for job in jobs:
+            if job[3] is None and job[1] not in self.unbatchable:
+                batches.setdefault(job[2], []).append(job)
+            else:
+                units.append([job])
+
+        return units + list(batches.values())
+
+    def submit(self, unit: List[Job]) -> None:
+        """Submit a unit of work to the process pool.
+        
+        Args:
+            unit: One job, or several CRF jobs sharing a preset
+        """
+        if len(unit) == 1:
+            input_file, output_file, preset, target_mb = unit[0]
+            self.set_status(f"Compressing ({preset})...")
+            self.log_msg(f"{LOG_RUN} Compressing {input_file} to {output_file} with preset '{preset}' and target {target_mb} MB")
+            task = (compress_video, input_file, output_file, preset, target_mb, self.FFMPEG_THREADS)
+        else:
+            preset = unit[0][2]
+            self.set_status(f"Compressing {len(unit)} files ({preset})...")
+            self.log_msg(f"{LOG_RUN} Compressing {len(unit)} files in one batch with preset '{preset}'")
+            # Each output keeps the full thread budget: before ffmpeg 7 the
+            # outputs are fed from one serial loop, so splitting the budget
+            # would leave the batch running on about one core
+            task = (
+                compress_many,
+                [(job[0], job[1]) for job in unit],
+                preset,
+                self.FFMPEG_THREADS
+            )
+
+        try:
             try:
-                self.set_status(f"Compressing ({preset})...")
-                self.log_msg(f"🔧 Compressing {input_file} to {output_file} with preset '{preset}' and target {target_mb} MB")
-                size_mb = compress_video(
-                    input_file,
-                    output_file,
-                    preset,
-                    target_mb
-                )
-                self.log_msg(f"✔ Готово: {output_file} ({size_mb:.2f} MB)")
-
-            except Exception as e:
-                self.set_status(f"Error: {str(e)}")
-                self.log_msg(f"❌ Error compressing {input_file}: {str(e)}")
-            finally:
+                future = self.executor.submit(*task)
+            except BrokenProcessPool:
+                # A worker died (OOM, crash, killed); start a fresh pool and retry once
+                self.log_msg(f"{LOG_ERR} Worker pool broke, restarting it")
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self.new_executor()
+                future = self.executor.submit(*task)
+        except Exception as e:
+            # Keep the dispatcher alive: report the failure and free the slot
+            self.set_status(f"Error: {str(e)}")
+            self.log_msg(f"{LOG_ERR} Could not start compression: {str(e)}")
+            for _ in unit:
                 self.task_queue.task_done()
-                if self.task_queue.empty():
-                    self.set_status("Idle")
+            self.slots.release()
+            return
+
+        future.add_done_callback(lambda f: self.on_done(unit, f))
 
-    def start_workers(self, count: int = 2) -> None:
-        """Start background worker threads.
+    def on_done(self, unit: List[Job], future: Future) -> None:
+        """Report the result of a finished pool task.
+        
+        Runs on the executor's callback thread; log_msg and set_status
+        marshal back to the Tk thread via root.after.
         
         Args:
-            count: Number of worker threads (default: 2)
+            unit: Jobs the task was running
+            future: Completed future holding a size (or list of sizes) in MB
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            if len(unit) > 1:
+                # Requeue one by one so a single bad input doesn't fail the
+                # whole batch; outputs the batch already finished are kept
+                self.log_msg(f"{LOG_ERR} Batch failed ({str(e)}), retrying files one by one")
+                for job in unit:
+                    if is_complete_output(job[1]):
+                        self.log_msg(f"{LOG_OK} Готово: {job[1]} ({get_file_size_mb(job[1]):.2f} MB)")
+                        continue
+                    self.unbatchable.add(job[1])
+                    self.task_queue.put(job)
+            else:
+                self.set_status(f"Error: {str(e)}")
+                self.log_msg(f"{LOG_ERR} Error compressing {unit[0][0]}: {str(e)}")
+        else:
+            sizes = result if len(unit) > 1 else [result]
+            for job, size_mb in zip(unit, sizes):
+                self.log_msg(f"{LOG_OK} Готово: {job[1]} ({size_mb:.2f} MB)")
+        finally:
+            for _ in unit:
+                self.task_queue.task_done()
+            self.slots.release()
+            if self.task_queue.unfinished_tasks == 0:
+                self.set_status("Idle")
+
+    def new_executor(self) -> ProcessPoolExecutor:
+        """Create the worker process pool.
+        
+        Workers are spawned rather than forked: the pool is started from the
+        dispatcher thread while Tk's mainloop runs, and forking a
+        multi-threaded process is unsafe.
+        
+        Returns:
+            New process pool with n_jobs workers
         """
-        for _ in range(count):
-            threading.Thread(target=self.worker, daemon=True).start()
+        return ProcessPoolExecutor(
+            max_workers=self.n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker
+        )
+
+    def start_workers(self) -> None:
+        """Start the process pool and the dispatcher thread."""
+        self.executor = self.new_executor()
+        threading.Thread(target=self.dispatcher, daemon=True).start()
+
+    def stop_workers(self) -> None:
+        """Stop the process pool, killing running encodes.
+        
+        shutdown(cancel_futures=True) only drops queued work: the pool is
+        still joined at interpreter exit, so running jobs would keep
+        encoding in the background after the window closes. Each worker is
+        killed together with its ffmpeg children instead.
+        """
+        # Results of killed jobs must not be reported to the destroyed window
+        self.root = None
+        processes = list((self.executor._processes or {}).values())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            kill_process_tree(process.pid)
 
     def process_video(self, url: str) -> None:
         """Download and queue video for compression.
@@ -83,7 +265,7 @@ class CompressorApp:
         output_file = output_filename(output_file)
 
         target_mb = self.get_target_mb()
-        self.log_msg(f"🎯 Target size: {target_mb or 'CRF mode'} MB")
+        self.log_msg(f"{LOG_TGT} Target size: {target_mb or 'CRF mode'} MB")
         self.task_queue.put((input_file, output_file, self.current_preset, target_mb))
 
     def choose_file(self) -> None:
@@ -98,13 +280,13 @@ class CompressorApp:
 
         if not file_path:
             self.set_status("Error: No file selected")
-            self.log_msg("❌ No file selected")
+            self.log_msg(f"{LOG_ERR} No file selected")
             return
         output_file = os.path.splitext(file_path)[0] + str(self.current_preset) + "_compressed.mp4"
         output_file = output_filename(output_file)
 
         target_mb = self.get_target_mb()
-        self.log_msg(f"🎯 Target size: {target_mb or 'CRF mode'} MB")
+        self.log_msg(f"{LOG_TGT} Target size: {target_mb or 'CRF mode'} MB")
 
         self.task_queue.put((file_path, output_file, self.current_preset, target_mb))
 
@@ -159,19 +341,37 @@ class CompressorApp:
     def log_msg(self, text: str) -> None:
         """Append message to log display (thread-safe).
         
+        Messages are buffered and written by a single coalesced flush
+        scheduled LOG_FLUSH_MS later, so bursts cost one widget update.
+        
         Args:
             text: Message to log
         """
         if not (self.root and self.log):
             return
 
-        def write() -> None:
-            self.log.config(state="normal")
-            self.log.insert("end", text + "\n")
-            self.log.see("end")
-            self.log.config(state="disabled")
+        with self.log_lock:
+            self.log_buffer.append(text)
+            if self.log_flush_scheduled:
+                return
+            self.log_flush_scheduled = True
 
-        self.root.after(0, write)
+        self.root.after(self.LOG_FLUSH_MS, self._flush_log)
+
+    def _flush_log(self) -> None:
+        """Write all buffered log messages to the widget in one update."""
+        with self.log_lock:
+            lines = list(self.log_buffer)
+            self.log_buffer.clear()
+            self.log_flush_scheduled = False
+
+        if not lines:
+            return
+
+        self.log.config(state="normal")
+        self.log.insert("end", "\n".join(lines) + "\n")
+        self.log.see("end")
+        self.log.config(state="disabled")
 
     def build_ui(self) -> None:
         """Build the Tkinter GUI."""
@@ -234,9 +434,12 @@ class CompressorApp:
         status_label.pack(fill="x", side="bottom")
 
     def start(self) -> None:
-        """Start the GUI application with worker threads."""
+        """Start the GUI application with the worker pool."""
         self.build_ui()
-        self.start_workers(2)
-        self.root.mainloop()
+        self.start_workers()
+        try:
+            self.root.mainloop()
+        finally:
+            self.stop_workers()
 
 
@@ -6,36 +6,44 @@ Defines preset profiles for different compression levels:
 - strong: up to 480p, aggressive compression (slow)
 """
 
-from typing import TypedDict
+from typing import NamedTuple, Optional
 
 
-class PresetConfig(TypedDict):
-    """Configuration for a compression preset."""
+class PresetConfig(NamedTuple):
+    """Configuration for a compression preset (immutable, safe to share across threads)."""
     max_height: int
     video_kbps_mult: float
     crf: int
     preset: str
+    tune: Optional[str]
+    scale_flags: str
 
 
 PRESETS: dict[str, PresetConfig] = {
-    "light": {
-        "max_height": 1080,
-        "video_kbps_mult": 1.0,
-        "crf": 20,
-        "preset": "slow"
-    },
-    "medium": {
-        "max_height": 720,
-        "video_kbps_mult": 0.75,
-        "crf": 23,
-        "preset": "slow"
-    },
-    "strong": {
-        "max_height": 480,
-        "video_kbps_mult": 0.5,
-        "crf": 28,
-        "preset": "medium"
-    }
+    "light": PresetConfig(
+        max_height=1080,
+        video_kbps_mult=1.0,
+        crf=20,
+        preset="slow",
+        tune="film",
+        scale_flags="lanczos"
+    ),
+    "medium": PresetConfig(
+        max_height=720,
+        video_kbps_mult=0.75,
+        crf=23,
+        preset="slow",
+        tune=None,
+        scale_flags="bicubic"
+    ),
+    "strong": PresetConfig(
+        max_height=480,
+        video_kbps_mult=0.5,
+        crf=28,
+        preset="medium",
+        tune="fastdecode",
+        scale_flags="fast_bilinear"
+    )
 }
 
 
@@ -46,14 +54,15 @@ def get_preset(preset_name: str) -> PresetConfig:
         preset_name: Preset name ('light', 'medium', or 'strong')
         
     Returns:
-        PresetConfig dictionary with compression parameters
+        PresetConfig tuple with compression parameters
         
     Raises:
         KeyError: If preset name is not found
     """
-    if preset_name not in PRESETS:
-        raise KeyError(f"Unknown preset: {preset_name}. Available: {list(PRESETS.keys())}")
-    return PRESETS[preset_name]
+    try:
+        return PRESETS[preset_name]
+    except KeyError:
+        raise KeyError(f"Unknown preset: {preset_name}. Available: {list(PRESETS.keys())}") from None
 
 
 def list_presets() -> list[str]:
@@ -1,13 +1,31 @@
-"""Utility functions for file operations."""
+"""Utility functions for file operations and ffmpeg capability caching."""
 
+import json
 import os
+import re
+import shutil
+import signal
+import subprocess
 from pathlib import Path
+from typing import Any, Dict, List
+
+
+# Creation flags that keep ffmpeg/ffprobe from flashing a console window on
+# Windows (0 elsewhere)
+NO_WINDOW_FLAGS = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+# Bytes -> megabytes factor, precomputed so conversions are a single multiply
+MB_PER_BYTE = 1.0 / (1024 * 1024)
+
+# On-disk cache of ffmpeg capabilities, invalidated when the binary changes
+CAPS_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "comress_video", "caps.json")
 
 
 def output_filename(path: str) -> str:
     """Generate a unique output filename to avoid overwriting existing files.
     
-    If the target file exists, appends a numeric suffix until a unique name is found.
+    If the target file exists, appends a numeric suffix one past the highest
+    existing one, found with a single directory scan.
     For example: video.mp4 → video_1.mp4 → video_2.mp4, etc.
     
     Args:
@@ -20,13 +38,26 @@ def output_filename(path: str) -> str:
         return path
         
     base, ext = os.path.splitext(path)
-    counter = 1
+    parent = os.path.dirname(path) or "."
+    base_stem = os.path.basename(base)
+    # Windows filesystems are case-insensitive, so VIDEO_3.MP4 counts too
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    pattern = re.compile(rf"^{re.escape(base_stem)}_(\d+){re.escape(ext)}$", flags)
+    
+    highest = 0
+    with os.scandir(parent) as entries:
+        for entry in entries:
+            match = pattern.match(entry.name)
+            if match:
+                highest = max(highest, int(match.group(1)))
     
-    while True:
-        new_path = f"{base}_{counter}{ext}"
-        if not os.path.exists(new_path):
-            return new_path
-        counter += 1
+    # Guard against names the scan can't see (e.g. created since, or
+    # differently normalized); normally this takes a single exists check
+    candidate = f"{base}_{highest + 1}{ext}"
+    while os.path.exists(candidate):
+        highest += 1
+        candidate = f"{base}_{highest + 1}{ext}"
+    return candidate
 
 
 def ensure_dir(dirpath: str) -> str:
@@ -51,4 +82,225 @@ def get_file_size_mb(filepath: str) -> float:
     Returns:
         File size in MB
     """
-    return os.path.getsize(filepath) / (1024 * 1024)
+    return os.stat(filepath).st_size * MB_PER_BYTE
+
+
+def get_cached_caps() -> Dict[str, Any]:
+    """Get ffmpeg capabilities, cached on disk across runs.
+    
+    The cache is keyed by the ffmpeg binary's path, mtime and size, so
+    upgrading ffmpeg triggers a fresh `-encoders` query.
+    
+    Returns:
+        Dict with an 'encoders' name list (empty if ffmpeg is not found)
+    """
+    binary = shutil.which("ffmpeg")
+    if not binary:
+        return {"encoders": []}
+    
+    stat = os.stat(binary)
+    key = f"{binary}:{stat.st_mtime_ns}:{stat.st_size}"
+    
+    try:
+        with open(CAPS_CACHE_FILE, "r", encoding="utf-8") as f:
+            caps = json.load(f)
+        if caps.get("key") == key:
+            return caps
+    except (OSError, ValueError):
+        pass
+    
+    caps = {
+        "key": key,
+        "encoders": _ffmpeg_encoders(binary),
+    }
+    # An empty listing means the query failed; caching it would keep
+    # hardware detection off until the ffmpeg binary changes
+    if caps["encoders"]:
+        save_cached_caps(caps)
+    return caps
+
+
+def save_cached_caps(caps: Dict[str, Any]) -> None:
+    """Write ffmpeg capabilities to the on-disk cache.
+    
+    Failures are ignored; the cache is only an optimization.
+    
+    Args:
+        caps: Capabilities dict as returned by get_cached_caps
+    """
+    try:
+        ensure_dir(os.path.dirname(CAPS_CACHE_FILE))
+        tmp_path = CAPS_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(caps, f)
+        os.replace(tmp_path, CAPS_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _ffmpeg_encoders(binary: str) -> List[str]:
+    """List encoder names supported by an ffmpeg binary.
+    
+    Args:
+        binary: Path to ffmpeg
+        
+    Returns:
+        Encoder names (empty if ffmpeg fails)
+    """
+    output = _run_ffmpeg_query(binary, "-encoders")
+    # Entries follow the " ------" separator line: " V....D libx264  description"
+    _, _, listing = output.partition("------")
+    return [line.split()[1] for line in listing.splitlines() if len(line.split()) > 1]
+
+
+def _run_ffmpeg_query(binary: str, flag: str) -> str:
+    """Run an ffmpeg listing command and return its stdout.
+    
+    Args:
+        binary: Path to ffmpeg
+        flag: Listing flag, e.g. '-encoders'
+        
+    Returns:
+        Command output, or an empty string if ffmpeg fails
+    """
+    try:
+        result = subprocess.run(
+            [binary, "-hide_banner", flag],
+            capture_output=True,
+            text=True,
+            creationflags=NO_WINDOW_FLAGS,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return result.stdout
+
+
+def kill_process_tree(pid: int) -> None:
+    """Kill a process together with the processes it started.
+    
+    On POSIX the process must lead its own process group (see
+    app.compressor.init_worker); on Windows taskkill walks the tree.
+    Processes that are already gone are ignored.
+    
+    Args:
+        pid: Process ID (and, on POSIX, process group ID)
+    """
+    if os.name == "nt":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=NO_WINDOW_FLAGS
+        )
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def fast_copy(src: str, dst: str) -> None:
+    """Copy a file using the cheapest mechanism the OS offers.
+    
+    Tries, in order: CopyFileExW on Windows; copy_file_range on Linux
+    (in-kernel, and a reflink on CoW filesystems such as btrfs/xfs);
+    sendfile (zero-copy in kernel space); and finally shutil.copyfile.
+    
+    Args:
+        src: Source file path
+        dst: Destination file path (overwritten if it exists)
+        
+    Raises:
+        OSError: If the copy fails
+    """
+    if os.name == "nt":
+        if _copy_file_ex(src, dst):
+            return
+    else:
+        for copier in (_copy_file_range, _sendfile_copy):
+            try:
+                if copier(src, dst):
+                    return
+            except OSError:
+                pass
+    shutil.copyfile(src, dst)
+
+
+def _copy_file_range(src: str, dst: str) -> bool:
+    """Copy with os.copy_file_range (Linux 4.5+, Python 3.8+).
+    
+    Args:
+        src: Source file path
+        dst: Destination file path
+        
+    Returns:
+        True if the copy completed, False if unsupported on this platform
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    return _kernel_copy(src, dst, lambda in_fd, out_fd, offset, count: os.copy_file_range(in_fd, out_fd, count))
+
+
+def _sendfile_copy(src: str, dst: str) -> bool:
+    """Copy with os.sendfile.
+    
+    Args:
+        src: Source file path
+        dst: Destination file path
+        
+    Returns:
+        True if the copy completed, False if unsupported on this platform
+    """
+    if not hasattr(os, "sendfile"):
+        return False
+    return _kernel_copy(src, dst, lambda in_fd, out_fd, offset, count: os.sendfile(out_fd, in_fd, offset, count))
+
+
+def _kernel_copy(src: str, dst: str, copy_chunk) -> bool:
+    """Drive an in-kernel copy primitive until the whole file is copied.
+    
+    Args:
+        src: Source file path
+        dst: Destination file path
+        copy_chunk: Callable (in_fd, out_fd, offset, count) -> bytes copied
+        
+    Returns:
+        True if the copy completed
+        
+    Raises:
+        OSError: If the primitive fails (caller falls back)
+    """
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        in_fd, out_fd = fin.fileno(), fout.fileno()
+        remaining = os.fstat(in_fd).st_size
+        offset = 0
+        while remaining > 0:
+            copied = copy_chunk(in_fd, out_fd, offset, min(remaining, 1 << 30))
+            if copied == 0:
+                break
+            offset += copied
+            remaining -= copied
+        return remaining <= 0
+
+
+def _copy_file_ex(src: str, dst: str) -> bool:
+    """Copy with kernel32.CopyFileExW on Windows.
+    
+    Args:
+        src: Source file path
+        dst: Destination file path
+        
+    Returns:
+        True if the copy succeeded
+    """
+    try:
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    except (ImportError, AttributeError, OSError):
+        return False
+    return bool(kernel32.CopyFileExW(
+        ctypes.c_wchar_p(os.path.abspath(src)),
+        ctypes.c_wchar_p(os.path.abspath(dst)),
+        None, None, None, 0
+    ))